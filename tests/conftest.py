@@ -0,0 +1,21 @@
+import os
+import pytest
+import torch
+
+
+@pytest.fixture(scope="session", autouse=True)
+def limit_cpu_threads():
+    # Torch uses a thread per core by default which oversubscribes the CPU during inference
+    # and makes the CPU-only tests much slower, so limit it to a single thread.
+    # A positive OMP_NUM_THREADS value (first value if it's a list such as "4,2") overrides this
+    if not torch.cuda.is_available():
+        threads = os.environ.get("OMP_NUM_THREADS", "").split(",")[0].strip()
+        torch.set_num_threads(int(threads) if threads.isdigit() and int(threads) > 0 else 1)
+
+
+# The transcription model is expensive to load so is shared across the whole test session
+@pytest.fixture(scope="session")
+def transcription_model():
+    from dataset.transcribe import Silero
+
+    return Silero()
@@ -11,7 +11,7 @@ from dataset.clip_generator import generate_clips_from_subtitles, clip_combiner
 from dataset.create_dataset import create_dataset
 from dataset.extend_existing_dataset import extend_existing_dataset
 from dataset.utils import similarity, add_suffix, get_invalid_characters
-from dataset.transcribe import TranscriptionModel, DeepSpeech, Silero
+from dataset.transcribe import TranscriptionModel, DeepSpeech
 
 
 TEXT = "the examination and testimony of the experts enabled the commission to conclude that five shots may have been fired"
@@ -354,9 +354,7 @@ def test_deepspeech():
     assert similarity(TEXT, transcription) > MIN_SYNTHESIS_SCORE
 
 
-def test_silero():
-    transcription_model = Silero()
-
+def test_silero(transcription_model):
     audio_path = os.path.join("test_samples", "audio.wav")
     transcription = transcription_model.transcribe(audio_path)
     assert similarity(TEXT, transcription) > MIN_SYNTHESIS_SCORE
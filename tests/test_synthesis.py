@@ -1,10 +1,10 @@
 import os
 import numpy as np
 import librosa
+import pytest
 import torch
 
 from dataset.utils import similarity
-from dataset.transcribe import Silero
 from synthesis.synthesize import load_model, synthesize
 from synthesis.vocoders import Hifigan
 from synthesis.vocoders.vocoder import Vocoder
@@ -12,6 +12,8 @@ from training.tacotron2_model.model import Tacotron2
 
 
 MIN_SYNTHESIS_SCORE = 0.3
+# Synthesis inputs vary in length so cudnn autotuning only adds overhead
+torch.backends.cudnn.benchmark = False
 
 
 class FakeVocoder(Vocoder):
@@ -30,14 +32,13 @@ class FakeModel:
         return None, self.mel_output, None, self.alignment
 
 
-def test_synthesize():
-    graph_path = "graph.png"
-    audio_path = "synthesized_audio.wav"
-
+def test_synthesize(tmp_path):
     model = FakeModel()
     vocoder = FakeVocoder()
 
     # Single line
+    graph_path = str(tmp_path / "single_line.png")
+    audio_path = str(tmp_path / "single_line.wav")
     text = "hello everybody my name is david attenborough"
     synthesize(
         model=model,
@@ -52,10 +53,9 @@ def test_synthesize():
     assert os.path.isfile(audio_path)
     assert librosa.get_duration(filename=audio_path) == 1
 
-    os.remove(graph_path)
-    os.remove(audio_path)
-
     # Multi line
+    graph_path = str(tmp_path / "multi_line.png")
+    audio_path = str(tmp_path / "multi_line.wav")
     text = [
         "the monkeys live in the jungle with their families.",
         "however, i prefer to live on the beach and enjoy the sun.",
@@ -74,10 +74,8 @@ def test_synthesize():
     assert os.path.isfile(audio_path)
     assert librosa.get_duration(filename=audio_path) == 2.5
 
-    os.remove(graph_path)
-    os.remove(audio_path)
-
     # Split text
+    audio_path = str(tmp_path / "split_text.wav")
     text = (
         "the monkeys live in the jungle with their families. however, i prefer to live on the beach and enjoy the sun."
     )
@@ -95,37 +93,44 @@ def test_synthesize():
     assert os.path.isfile(audio_path)
     assert librosa.get_duration(filename=audio_path) == 2.5
 
-    os.remove(audio_path)
-
 
 class FakeModelForSynthesis:
-    mel_output = torch.load(os.path.join("test_samples", "mel.pt"))
+    def __init__(self, mel_output):
+        self.mel_output = mel_output
 
     def inference(self, sequence, max_decoder_steps):
         return None, self.mel_output, None, None
 
 
-def test_hifigan_synthesis():
-    hifigan_model_path = os.path.join("test_samples", "hifigan.pt")
-    hifigan_config_path = os.path.join("test_samples", "config.json")
-    audio_path = "synthesized_audio.wav"
-    transcription_model = Silero()
+@pytest.fixture(scope="module")
+def synthesis_model():
+    # Returns a precomputed mel rather than running Tacotron2, so vocoder tests only pay for the vocoder
+    return FakeModelForSynthesis(torch.load(os.path.join("test_samples", "mel.pt")))
+
+
+@pytest.fixture
+def hifigan_vocoder():
+    return Hifigan(os.path.join("test_samples", "hifigan.pt"), os.path.join("test_samples", "config.json"))
+
+
+@pytest.mark.parametrize("vocoder_fixture", ["hifigan_vocoder"])
+def test_vocoder_synthesis(vocoder_fixture, request, synthesis_model, transcription_model, tmp_path):
+    audio_path = str(tmp_path / "synthesized_audio.wav")
+    vocoder = request.getfixturevalue(vocoder_fixture)
 
-    hifigan = Hifigan(hifigan_model_path, hifigan_config_path)
     text = "the monkeys live"
-    synthesize(
-        model=FakeModelForSynthesis(),
-        text=text,
-        graph_path=None,
-        audio_path=audio_path,
-        vocoder=hifigan,
-    )
+    with torch.inference_mode():
+        synthesize(
+            model=synthesis_model,
+            text=text,
+            graph_path=None,
+            audio_path=audio_path,
+            vocoder=vocoder,
+        )
 
     assert os.path.isfile(audio_path)
     assert similarity(text, transcription_model.transcribe(audio_path)) > MIN_SYNTHESIS_SCORE
 
-    os.remove(audio_path)
-
 
 def test_load_model():
     model_path = os.path.join("test_samples", "model.pt")
@@ -10,10 +10,14 @@ from dataset import CHARACTER_ENCODING
 from training.clean_text import clean_text
 from training.checkpoint import (
     load_checkpoint,
+    load_checkpoint_dict,
     save_checkpoint,
+    wait_for_checkpoint,
+    copy_to_cpu,
     checkpoint_cleanup,
     warm_start_model,
     transfer_symbols_embedding,
+    find_symbol_index,
 )
 from training.voice_dataset import VoiceDataset
 from training.tacotron2_model import Tacotron2
@@ -370,6 +374,63 @@ def test_load_and_save_checkpoint():
     shutil.rmtree(checkpoint_folder)
 
 
+def test_save_checkpoint_in_background():
+    model = torch.nn.Linear(2, 2)
+    optimizer = torch.optim.Adam(model.parameters(), lr=0.1)
+    checkpoint_folder = "test-checkpoints"
+    os.makedirs(checkpoint_folder)
+
+    checkpoint_path = save_checkpoint(
+        model, optimizer, 0.1, 1000, [], 0, checkpoint_folder, 1000, 1000, background=True
+    )
+    # Changes made after saving shouldn't be included in the checkpoint
+    weight = model.weight.detach().clone()
+    with torch.no_grad():
+        model.weight.zero_()
+    wait_for_checkpoint()
+
+    assert os.listdir(checkpoint_folder) == ["checkpoint_1000"]
+    state_dict = torch.load(checkpoint_path)["state_dict"]
+    assert torch.equal(state_dict["weight"], weight)
+    # Module versions must be kept for load_state_dict
+    assert state_dict._metadata == model.state_dict()._metadata
+
+    shutil.rmtree(checkpoint_folder)
+
+
+def test_copy_to_cpu():
+    weight = torch.ones(2, 2)
+    state = {"a": weight, "b": weight, "steps": torch.tensor(1), "groups": [{"lr": 0.1}]}
+
+    state_copy = copy_to_cpu(state, dtype=torch.float16)
+    weight.zero_()
+
+    # Tied tensors should share a single copy
+    assert state_copy["a"] is state_copy["b"]
+    assert torch.equal(state_copy["a"], torch.ones(2, 2, dtype=torch.float16))
+    # Non floating point tensors should keep their dtype
+    assert state_copy["steps"].dtype == torch.int64
+    assert state_copy["groups"] == [{"lr": 0.1}]
+
+    # State dicts should keep their type & module versions
+    state_dict = torch.nn.BatchNorm1d(2).state_dict()
+    state_dict_copy = copy_to_cpu(state_dict, dtype=torch.float16)
+    assert type(state_dict_copy) is type(state_dict)
+    assert state_dict_copy._metadata == state_dict._metadata
+
+
+def test_load_checkpoint_dict():
+    checkpoint_path = "test-checkpoint.pt"
+    checkpoint = {"iteration": 1, "state_dict": {"weight": torch.arange(4.0)}}
+    torch.save(checkpoint, checkpoint_path)
+
+    checkpoint_dict = load_checkpoint_dict(checkpoint_path)
+    assert checkpoint_dict["iteration"] == 1
+    assert torch.equal(checkpoint_dict["state_dict"]["weight"], checkpoint["state_dict"]["weight"])
+
+    os.remove(checkpoint_path)
+
+
 class MockedEmbeddingLayer:
     weight = torch.zeros(3)
 
@@ -390,18 +451,57 @@ def test_transfer_symbols_embedding():
     assert embedding_layer.weight[2] == 0.3
 
 
-@mock.patch("os.remove")
-def test_checkpoint_cleanup_should_remove(remove):
-    # Old checkpoint (checkpoint_1000) should be removed
-    checkpoint_cleanup("checkpoints", 2000, 1000, 10000)
-    remove.assert_called_with(os.path.join("checkpoints", "checkpoint_1000"))
+def test_transfer_symbols_embedding_with_unmatched_symbols():
+    original_embedding_weight = torch.arange(12, dtype=torch.float).reshape(3, 4)
+    embedding_layer = torch.nn.Embedding(6, 4)
+    torch.nn.init.constant_(embedding_layer.weight, -100)
+    original_symbols = ["a", "c", "e"]
+    new_symbols = ["e", "x", "a", "y"]
 
+    transfer_symbols_embedding(original_embedding_weight, embedding_layer, new_symbols, original_symbols)
+    weight = embedding_layer.weight.detach()
 
-@mock.patch("os.remove")
-def test_checkpoint_cleanup_should_not_remove(remove):
-    # Backup checkpoint (checkpoint_20000) should not be removed
-    checkpoint_cleanup("checkpoints", 21000, 1000, 10000)
-    assert not remove.called
+    # Matched symbols should copy the original rows
+    assert torch.equal(weight[0], original_embedding_weight[2])
+    assert torch.equal(weight[2], original_embedding_weight[0])
+    # Unmatched symbols should be re-initialised
+    assert not torch.any(weight[1] == -100)
+    assert not torch.any(weight[3] == -100)
+    # Rows past the new symbols should be untouched
+    assert torch.equal(weight[4:], torch.full((2, 4), -100.0))
+
+
+def test_find_symbol_index():
+    symbol_to_index = {"_": 0, "e": 1, "A": 2}
+
+    assert find_symbol_index("_", symbol_to_index) == 0
+    assert find_symbol_index("é", symbol_to_index) == 1
+    assert find_symbol_index("E", symbol_to_index) == 1
+    assert find_symbol_index("a", symbol_to_index) == 2
+    assert find_symbol_index("b", symbol_to_index) is None
+
+
+def test_checkpoint_cleanup():
+    checkpoint_folder = "test-checkpoints"
+    os.makedirs(checkpoint_folder)
+    for name in ["checkpoint_0", "checkpoint_1000", "checkpoint_1500", "checkpoint_10000", "checkpoint_20000"]:
+        open(os.path.join(checkpoint_folder, name), "w").close()
+    open(os.path.join(checkpoint_folder, "checkpoint_21000"), "w").close()
+    open(os.path.join(checkpoint_folder, "checkpoint_21000.tmp"), "w").close()
+
+    checkpoint_cleanup(checkpoint_folder, 21000, 1000, 10000)
+
+    # Old checkpoints (checkpoint_1000 & checkpoint_1500) should be removed
+    # Backup checkpoints (checkpoint_0, checkpoint_10000 & checkpoint_20000) should not be removed
+    assert set(os.listdir(checkpoint_folder)) == {
+        "checkpoint_0",
+        "checkpoint_10000",
+        "checkpoint_20000",
+        "checkpoint_21000",
+        "checkpoint_21000.tmp",
+    }
+
+    shutil.rmtree(checkpoint_folder)
 
 
 def test_warm_start_model():
@@ -418,6 +518,31 @@ def test_warm_start_model():
             assert torch.equal(model_dict[k], checkpoint_dict[k])
 
 
+class MockedWarmStartModel(torch.nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.embedding = torch.nn.Embedding(3, 2)
+        self.linear = torch.nn.Linear(2, 2)
+
+
+def test_warm_start_model_with_missing_layers():
+    checkpoint_path = "test-checkpoint.pt"
+    pretrained = MockedWarmStartModel()
+    state_dict = pretrained.state_dict()
+    del state_dict["linear.bias"]
+    torch.save({"state_dict": state_dict}, checkpoint_path)
+
+    model = MockedWarmStartModel()
+    bias = model.linear.bias.detach().clone()
+    model = warm_start_model(checkpoint_path, model)
+
+    # Layers missing from the checkpoint should keep their original weights
+    assert torch.equal(model.linear.weight, pretrained.linear.weight)
+    assert torch.equal(model.linear.bias, bias)
+
+    os.remove(checkpoint_path)
+
+
 # Labels file
 def test_load_labels_file():
     metadata_path = os.path.join("test_samples", "dataset", "metadata.csv")
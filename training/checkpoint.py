@@ -1,18 +1,58 @@
 import os
+import re
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 import torch
 from typing import Optional
 from unidecode import unidecode
 
 # fmt: off
-NVIDIA_ALPHABET = ['_', '-', '!', "'", '(', ')', ',', '.', ':', ';', '?', ' ',
+NVIDIA_ALPHABET = ('_', '-', '!', "'", '(', ')', ',', '.', ':', ';', '?', ' ',
                    'A', 'B', 'C', 'D', 'E', 'F', 'G', 'H', 'I', 'J', 'K', 'L', 'M', 'N', 'O', 'P', 'Q', 'R', 'S', 'T', 'U', 'V', 'W', 'X', 'Y', 'Z',
                    'a', 'b', 'c', 'd', 'e', 'f', 'g', 'h', 'i', 'j', 'k', 'l', 'm', 'n', 'o', 'p', 'q', 'r', 's', 't', 'u', 'v', 'w', 'x', 'y', 'z',
                    '@AA', '@AA0', '@AA1', '@AA2', '@AE', '@AE0', '@AE1', '@AE2', '@AH', '@AH0', '@AH1', '@AH2', '@AO', '@AO0', '@AO1', '@AO2', '@AW',
                    '@AW0', '@AW1', '@AW2', '@AY', '@AY0', '@AY1', '@AY2', '@B', '@CH', '@D', '@DH', '@EH', '@EH0', '@EH1', '@EH2', '@ER', '@ER0',
                    '@ER1', '@ER2', '@EY', '@EY0', '@EY1', '@EY2', '@F', '@G', '@HH', '@IH', '@IH0', '@IH1', '@IH2', '@IY', '@IY0', '@IY1', '@IY2',
                    '@JH', '@K', '@L', '@M', '@N', '@NG', '@OW', '@OW0', '@OW1', '@OW2', '@OY', '@OY0', '@OY1', '@OY2', '@P', '@R', '@S', '@SH', '@T',
-                   '@TH', '@UH', '@UH0', '@UH1', '@UH2', '@UW', '@UW0', '@UW1', '@UW2', '@V', '@W', '@Y', '@Z', '@ZH']
+                   '@TH', '@UH', '@UH0', '@UH1', '@UH2', '@UW', '@UW0', '@UW1', '@UW2', '@V', '@W', '@Y', '@Z', '@ZH')
 # fmt: on
+NVIDIA_SYMBOL_TO_INDEX = {symbol: index for index, symbol in enumerate(NVIDIA_ALPHABET)}
+
+# torch.load only supports memory-mapping checkpoints from torch 2.1 onwards
+TORCH_VERSION = tuple(int(v) for v in torch.__version__.split("+")[0].split(".")[:2])
+MMAP_SUPPORTED = TORCH_VERSION >= (2, 1)
+
+CHECKPOINT_NAME_PATTERN = re.compile(r"checkpoint_(\d+)")
+
+# Background checkpoints are written by a single thread (created on first use) so training isn't blocked on disk writes.
+# Only one save is kept in flight at a time to bound the memory held by checkpoint copies.
+checkpoint_executor = None
+pending_checkpoint = None
+
+
+def load_checkpoint_dict(checkpoint_path, map_location="cpu"):
+    """
+    Loads a checkpoint file.
+    When loading to the CPU the file is memory-mapped where supported so tensors are paged in on demand
+    rather than read into memory in full before unpickling.
+
+    Parameters
+    ----------
+    checkpoint_path : str
+        Path to checkpoint
+    map_location : str or torch.device (optional)
+        Device to load tensors onto (default is "cpu")
+
+    Returns
+    -------
+    dict
+        Checkpoint dictionary
+    """
+    # mmap is only possible with the zipfile format (torch >= 1.6 default)
+    if MMAP_SUPPORTED and torch.device(map_location).type == "cpu" and zipfile.is_zipfile(checkpoint_path):
+        return torch.load(checkpoint_path, map_location=map_location, mmap=True)
+    return torch.load(checkpoint_path, map_location=map_location)
 
 
 def load_checkpoint(checkpoint_path, model, optimizer, train_loader):
@@ -41,7 +81,10 @@ def load_checkpoint(checkpoint_path, model, optimizer, train_loader):
     int
         current iteration number
     """
-    checkpoint_dict = torch.load(checkpoint_path, map_location="cpu")
+    # Load tensors straight onto the model's device to avoid a second CPU -> GPU copy
+    parameter = next(model.parameters(), None)
+    device = parameter.device if parameter is not None else "cpu"
+    checkpoint_dict = load_checkpoint_dict(checkpoint_path, map_location=device)
     model.load_state_dict(checkpoint_dict["state_dict"])
     optimizer.load_state_dict(checkpoint_dict["optimizer"])
     iteration = checkpoint_dict["iteration"]
@@ -49,6 +92,58 @@ def load_checkpoint(checkpoint_path, model, optimizer, train_loader):
     return model, optimizer, iteration, epoch
 
 
+@lru_cache(maxsize=None)
+def cached_unidecode(symbol):
+    """
+    Cached unidecode lookup, as the same symbols are transliterated on every warm start.
+
+    Parameters
+    ----------
+    symbol : str
+        Symbol to transliterate
+
+    Returns
+    -------
+    str
+        ASCII transliteration of the symbol
+    """
+    return unidecode(symbol)
+
+
+def find_symbol_index(symbol, symbol_to_index):
+    """
+    Finds the index of the closest matching symbol from a pretrained model.
+
+    Parameters
+    ----------
+    symbol : str
+        Symbol to find
+    symbol_to_index : dict
+        Dictionary of pretrained model symbols to embedding index
+
+    Returns
+    -------
+    int
+        Embedding index of the matching symbol (None if no match was found)
+    """
+    # transfers matching symbols from pretrained model to new model  e.g: 'e' -> 'e'
+    index = symbol_to_index.get(symbol)
+
+    # transfers non-ascii symbols from pretrained model to new model  e.g: 'e' -> 'é'
+    if index is None:
+        index = symbol_to_index.get(cached_unidecode(symbol))
+
+    # transfers upper-case symbols from pretrained model to new model  e.g: 'E' -> 'e'
+    if index is None:
+        index = symbol_to_index.get(symbol.upper())
+
+    # transfers lower-case symbols from pretrained model to new model  e.g: 'e' -> 'E'
+    if index is None:
+        index = symbol_to_index.get(symbol.lower())
+
+    return index
+
+
 def transfer_symbols_embedding(
     original_embedding_weight: torch.Tensor, embedding_layer, new_symbols: list, original_symbols: Optional[list] = None
 ):
@@ -73,37 +168,49 @@ def transfer_symbols_embedding(
         len(original_symbols) == original_embedding_weight.shape[0]
     ), f"length of original_symbols does not match length of checkpoint model embedding! Got {len(original_symbols)} and {original_embedding_weight.shape[0]}."
 
-    weight_tensor = original_embedding_weight.data
-    original_std = weight_tensor.std()
-    original_mean = weight_tensor.mean()
+    device = embedding_layer.weight.device
+    dtype = embedding_layer.weight.dtype
+    # move the checkpoint embedding to the model once rather than copying each symbol across
+    weight_tensor = original_embedding_weight.data.to(device=device, dtype=dtype)
+    # read the statistics back once as python floats rather than syncing on every use
+    original_std = weight_tensor.std().item()
+    original_mean = weight_tensor.mean().item()
 
-    weight_dict = {}
-    for symbol_index, symbol in enumerate(original_symbols):
-        # save vector for each symbol into it's own key
-        weight_dict[symbol] = weight_tensor[symbol_index]
+    if original_symbols is NVIDIA_ALPHABET:
+        symbol_to_index = NVIDIA_SYMBOL_TO_INDEX
+    else:
+        symbol_to_index = {symbol: index for index, symbol in enumerate(original_symbols)}
+    destination_indices = []
+    source_indices = []
+    missing_indices = []
 
     for symbol_index, new_symbol in enumerate(new_symbols):
-        # transfers matching symbols from pretrained model to new model  e.g: 'e' -> 'e'
-        if new_symbol in weight_dict:
-            embedding_layer.weight.data[symbol_index] = weight_dict[new_symbol]
-
-        # transfers non-ascii symbols from pretrained model to new model  e.g: 'e' -> 'é'
-        elif unidecode(new_symbol) in weight_dict:
-            embedding_layer.weight.data[symbol_index] = weight_dict[unidecode(new_symbol)]
-
-        # transfers upper-case symbols from pretrained model to new model  e.g: 'E' -> 'e'
-        elif new_symbol.upper() in weight_dict:
-            embedding_layer.weight.data[symbol_index] = weight_dict[new_symbol.upper()]
-
-        # transfers lower-case symbols from pretrained model to new model  e.g: 'e' -> 'E'
-        elif new_symbol.lower() in weight_dict:
-            embedding_layer.weight.data[symbol_index] = weight_dict[new_symbol.lower()]
-
+        source_index = find_symbol_index(new_symbol, symbol_to_index)
+        if source_index is not None:
+            destination_indices.append(symbol_index)
+            source_indices.append(source_index)
         else:
-            # if new_symbol doesn't exist in pretrained model
-            # initialize new symbol with average mean+std of the pretrained embedding,
-            # to ensure no large loss spikes when the new symbol is seen for the first time.
-            embedding_layer.weight.data[symbol_index] = weight_tensor[0].clone().normal_(original_mean, original_std)
+            missing_indices.append(symbol_index)
+
+    with torch.no_grad():
+        # copy all matched symbol vectors across in a single gather
+        if destination_indices:
+            embedding_layer.weight.index_copy_(
+                0,
+                torch.tensor(destination_indices, device=device),
+                weight_tensor.index_select(0, torch.tensor(source_indices, device=device)),
+            )
+
+        # if new_symbol doesn't exist in pretrained model
+        # initialize new symbol with average mean+std of the pretrained embedding,
+        # to ensure no large loss spikes when the new symbol is seen for the first time.
+        if missing_indices:
+            new_weights = torch.empty((len(missing_indices),) + weight_tensor.shape[1:], dtype=dtype, device=device)
+            embedding_layer.weight.index_copy_(
+                0,
+                torch.tensor(missing_indices, device=device),
+                new_weights.normal_(original_mean, original_std),
+            )
 
 
 def warm_start_model(checkpoint_path, model, symbols=None, ignore_layers=["embedding.weight"]):
@@ -128,28 +235,26 @@ def warm_start_model(checkpoint_path, model, symbols=None, ignore_layers=["embed
     Tacotron2
         Loaded tacotron2 model
     """
-    checkpoint_dict = torch.load(checkpoint_path, map_location="cpu")
-    model_dict = checkpoint_dict["state_dict"]
+    # Only keep the state dict (and not the optimizer state) in memory
+    model_dict = load_checkpoint_dict(checkpoint_path)["state_dict"]
+    embedding_weight = model_dict.get("embedding.weight")
     if ignore_layers:
-        model_dict = {k: v for k, v in model_dict.items() if k not in ignore_layers}
-        dummy_dict = model.state_dict()
-        dummy_dict.update(model_dict)
-        model_dict = dummy_dict
-    model.load_state_dict(model_dict)
+        # Remove ignored layers in place rather than copying the state dict
+        for layer in ignore_layers:
+            model_dict.pop(layer, None)
+        # Layers missing from the checkpoint keep the fresh model's weights
+        _, unexpected_keys = model.load_state_dict(model_dict, strict=False)
+        assert unexpected_keys == [], f"Checkpoint contains keys not in the model: {unexpected_keys}"
+    else:
+        model.load_state_dict(model_dict)
+    old_symbols = model_dict.get("symbols", None)
+    del model_dict
 
     # transfer embedding.weight manually to prevent size conflicts
-    old_symbols = model_dict.get("symbols", None)
     if symbols is None:
         print("WARNING: called warm_start_model with symbols not set. This will be unsupported in the future.")
-    if (
-        symbols is not None
-        and old_symbols != symbols
-        and hasattr(model, "embedding")
-        and "embedding.weight" in model_dict
-    ):
-        transfer_symbols_embedding(
-            checkpoint_dict["state_dict"]["embedding.weight"], model.embedding, symbols, old_symbols
-        )
+    if symbols is not None and old_symbols != symbols and hasattr(model, "embedding") and embedding_weight is not None:
+        transfer_symbols_embedding(embedding_weight, model.embedding, symbols, old_symbols)
     return model
 
 
@@ -184,6 +289,8 @@ def save_checkpoint(
     output_directory,
     checkpoint_frequency,
     checkpoint_backup_frequency,
+    checkpoint_dtype=None,
+    background=False,
 ):
     """
     Save training checkpoint.
@@ -209,32 +316,141 @@ def save_checkpoint(
         Frequency of checkpoint creation (in iterations)
     checkpoint_backup_frequency : int
         Frequency of checkpoint backups (in iterations)
+    checkpoint_dtype : torch.dtype (optional)
+        Dtype to save model weights as, e.g. torch.float16 halves checkpoint size (default is the model's dtype).
+        Resuming training from a float16 checkpoint starts from the rounded weights
+    background : bool (optional)
+        Write the checkpoint in a background thread so training isn't blocked (default is False).
+        See wait_for_checkpoint. Not supported inside the application's progress thread as it cannot create threads
 
     Returns
     -------
     str
         Checkpoint path
     """
+    global checkpoint_executor, pending_checkpoint
+
     checkpoint_name = "checkpoint_{}".format(iteration)
     output_path = os.path.join(output_directory, checkpoint_name)
-    torch.save(
-        {
-            "iteration": iteration,
-            "state_dict": get_state_dict(model),
-            "optimizer": optimizer.state_dict(),
-            "learning_rate": learning_rate,
-            "epoch": epoch,
-            "symbols": symbols,
-        },
-        output_path,
-    )
-    checkpoint_cleanup(output_directory, iteration, checkpoint_frequency, checkpoint_backup_frequency)
+    # Wait for the previous save first so only one copy of the checkpoint is held at a time
+    wait_for_checkpoint()
+
+    state_dict = get_state_dict(model)
+    optimizer_state = optimizer.state_dict()
+    if background:
+        # Copy state to the CPU on the calling thread so the checkpoint is consistent
+        # even though training continues while it is written
+        state_dict = copy_to_cpu(state_dict, dtype=checkpoint_dtype)
+        optimizer_state = copy_to_cpu(optimizer_state)
+    elif checkpoint_dtype is not None:
+        state_dict = copy_to_cpu(state_dict, dtype=checkpoint_dtype)
+
+    checkpoint = {
+        "iteration": iteration,
+        "state_dict": state_dict,
+        "optimizer": optimizer_state,
+        "learning_rate": learning_rate,
+        "epoch": epoch,
+        "symbols": symbols,
+    }
+    args = (checkpoint, output_path, output_directory, iteration, checkpoint_frequency, checkpoint_backup_frequency)
+    if background:
+        if checkpoint_executor is None:
+            checkpoint_executor = ThreadPoolExecutor(max_workers=1)
+        pending_checkpoint = checkpoint_executor.submit(write_checkpoint, *args)
+    else:
+        write_checkpoint(*args)
     return output_path
 
 
+def copy_to_cpu(state, dtype=None, copies=None):
+    """
+    Copies all tensors in a (nested) state dict to the CPU.
+    Keeps the container types and state dict metadata.
+    Tensors which share memory (such as tied weights) share a single copy,
+    so the zipfile serializer still only writes them once.
+
+    Parameters
+    ----------
+    state : object
+        State dict or value to copy
+    dtype : torch.dtype (optional)
+        Dtype to convert floating point tensors to (default is None, which keeps their dtype)
+    copies : dict (optional)
+        Tensors already copied, used internally when recursing
+
+    Returns
+    -------
+    object
+        Copy of the state with all tensors on the CPU
+    """
+    if copies is None:
+        copies = {}
+
+    if isinstance(state, torch.Tensor):
+        key = (state.device, state.data_ptr(), state.dtype, tuple(state.shape), state.stride())
+        if key not in copies:
+            target_dtype = dtype if dtype is not None and state.is_floating_point() else state.dtype
+            copies[key] = state.detach().to("cpu", dtype=target_dtype, copy=True)
+        return copies[key]
+    elif isinstance(state, dict):
+        state_copy = type(state)((key, copy_to_cpu(value, dtype, copies)) for key, value in state.items())
+        # state_dict() stores module versions in _metadata which load_state_dict relies on
+        if hasattr(state, "_metadata"):
+            state_copy._metadata = state._metadata
+        return state_copy
+    elif isinstance(state, (list, tuple)):
+        return type(state)(copy_to_cpu(value, dtype, copies) for value in state)
+    return state
+
+
+def write_checkpoint(
+    checkpoint, output_path, output_directory, iteration, checkpoint_frequency, checkpoint_backup_frequency
+):
+    """
+    Writes a checkpoint to disk & calls checkpoint cleanup on completion.
+    Writes to a temporary file first so a partially written checkpoint is never left at output_path.
+
+    Parameters
+    ----------
+    checkpoint : dict
+        Checkpoint data
+    output_path : str
+        Path to save checkpoint to
+    output_directory : str
+        Checkpoint folder
+    iteration : int
+        Current iteration
+    checkpoint_frequency : int
+        Frequency of checkpoint creation (in iterations)
+    checkpoint_backup_frequency : int
+        Frequency of checkpoint backups (in iterations)
+    """
+    temp_path = output_path + ".tmp"
+    torch.save(checkpoint, temp_path, _use_new_zipfile_serialization=True, pickle_protocol=4)
+    os.replace(temp_path, output_path)
+    checkpoint_cleanup(output_directory, iteration, checkpoint_frequency, checkpoint_backup_frequency)
+
+
+def wait_for_checkpoint():
+    """
+    Blocks until the checkpoint currently being saved in the background (if any) has been written.
+
+    Raises
+    -------
+    Exception
+        If the checkpoint failed to save
+    """
+    global pending_checkpoint
+
+    if pending_checkpoint is not None:
+        checkpoint, pending_checkpoint = pending_checkpoint, None
+        checkpoint.result()
+
+
 def checkpoint_cleanup(output_directory, iteration, checkpoint_frequency, checkpoint_backup_frequency):
     """
-    Deletes previous checkpoint if it should be kept as a backup
+    Deletes all previous checkpoints that shouldn't be kept as a backup
 
     Parameters
     ----------
@@ -247,11 +463,18 @@ def checkpoint_cleanup(output_directory, iteration, checkpoint_frequency, checkp
     checkpoint_backup_frequency : int
         Frequency of checkpoint backups (in iterations)
     """
-    if iteration > 0:
-        last_checkpoint = iteration - checkpoint_frequency
-        if last_checkpoint % checkpoint_backup_frequency != 0:
-            # Last checkpoint shouldn't be kept as a backup
-            try:
-                os.remove(os.path.join(output_directory, "checkpoint_{}".format(last_checkpoint)))
-            except OSError:
-                pass
+    with os.scandir(output_directory) as entries:
+        old_checkpoints = []
+        for entry in entries:
+            match = CHECKPOINT_NAME_PATTERN.fullmatch(entry.name)
+            if match:
+                checkpoint_iteration = int(match.group(1))
+                if checkpoint_iteration < iteration and checkpoint_iteration % checkpoint_backup_frequency != 0:
+                    # Checkpoint shouldn't be kept as a backup
+                    old_checkpoints.append(entry.path)
+
+    for checkpoint_path in old_checkpoints:
+        try:
+            os.remove(checkpoint_path)
+        except OSError:
+            pass
@@ -19,7 +19,7 @@ from torch.utils.tensorboard import SummaryWriter
 from training import DEFAULT_ALPHABET, SEED
 from training.clean_text import clean_text
 from training.voice_dataset import VoiceDataset
-from training.checkpoint import load_checkpoint, save_checkpoint, warm_start_model
+from training.checkpoint import load_checkpoint, save_checkpoint, wait_for_checkpoint, warm_start_model
 from training.validate import validate
 from training.utils import (
     get_available_memory,
@@ -59,6 +59,8 @@ def train(
     iters_per_backup_checkpoint=10000,
     train_size=0.8,
     alignment_sentence="",
+    checkpoint_dtype=None,
+    background_checkpoint_saving=False,
     logging=logging,
 ):
     """
@@ -98,6 +100,12 @@ def train(
         Percentage of samples to use for training (default is 80%/0.8)
     alignment_sentence : str (optional)
         Sentence for alignment graph to analyse performance
+    checkpoint_dtype : torch.dtype (optional)
+        Dtype to save checkpoint weights as, e.g. torch.float16 for smaller checkpoints (default is the model's dtype).
+        Resuming training from a float16 checkpoint starts from the rounded weights
+    background_checkpoint_saving : bool (optional)
+        Write checkpoints in a background thread so training isn't blocked (default is False).
+        Must stay disabled when run by the application as its progress thread cannot create other threads
     logging : logging (optional)
         Logging object to write logs to
 
@@ -254,8 +262,11 @@ def train(
                     output_directory,
                     iters_per_checkpoint,
                     iters_per_backup_checkpoint,
+                    checkpoint_dtype,
+                    background_checkpoint_saving,
                 )
                 if alignment_sequence is not None:
+                    wait_for_checkpoint()
                     try:
                         _, _, _, alignment = load_model(checkpoint_path).inference(alignment_sequence)
                         graph_path = os.path.join(alignment_folder, "checkpoint_{}.png".format(iteration))
@@ -290,7 +301,10 @@ def train(
         output_directory,
         iters_per_checkpoint,
         iters_per_backup_checkpoint,
+        checkpoint_dtype,
+        background_checkpoint_saving,
     )
+    wait_for_checkpoint()
     logging.info("Saving model and optimizer state at iteration {} to {}".format(iteration, checkpoint_path))
 
 
@@ -328,4 +342,5 @@ if __name__ == "__main__":
         epochs=args.epochs,
         batch_size=args.batch_size,
         transfer_learning_path=args.transfer_learning_path,
+        background_checkpoint_saving=True,
     )